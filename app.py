@@ -4,13 +4,16 @@ import time
 from dotenv import load_dotenv
 import uuid
 import base64
+import hashlib
+from datetime import date
 
 from utils.logging_interface import render_logging_interface
 
 from utils.calculations import (
     compute_kpis, 
     aggregate_to_farm_level,
-    compute_esg_scores
+    compute_esg_scores,
+    emissions_by_source
 )
 from utils.ai_insights import generate_ai_insights
 from utils.visualisations import (
@@ -32,9 +35,8 @@ st.set_page_config(
     initial_sidebar_state="expanded"
 )
 
-# Load CSS
-def load_css():
-    st.markdown("""
+# Global styles - a plain constant (no interpolation) emitted once per script run
+STYLE_BLOCK = """
     <style>
     @import url('https://fonts.googleapis.com/css2?family=Inter:wght@400;600;700&display=swap');
     
@@ -87,6 +89,12 @@ def load_css():
         color: var(--color-brown-dark);
     }
     
+    .metric-row {
+        display: grid;
+        grid-template-columns: repeat(4, minmax(0, 1fr));
+        gap: 1rem;
+    }
+    
     .metric-card {
         background: white;
         border-radius: 15px;
@@ -223,7 +231,14 @@ def load_css():
     #MainMenu {visibility: hidden;}
     footer {visibility: hidden;}
     </style>
-    """, unsafe_allow_html=True) 
+    """
+
+# Load CSS
+def load_css():
+    # Re-emitted on every run: Streamlit drops elements a rerun doesn't repeat,
+    # so gating this on session_state would lose the styles after one interaction.
+    # st.html passes the block straight through without the markdown parser
+    st.html(STYLE_BLOCK)
 
 load_css()
 
@@ -284,6 +299,21 @@ def create_progress_bar(value, max_value=100, status="neutral"):
     </div>
     """
 
+# Helper function for Quick Stats cards
+def create_metric_card(icon, title, value, status_info, border_color=None):
+    """Return the HTML string for one metric card: icon, title, value and a coloured status line"""
+    status_text, status_class, emoji, _ = status_info
+    if border_color is None:
+        border_color = '#4a7c29' if 'healthy' in status_class or 'low' in status_class else '#c62828'
+    return (
+        f'<div class="metric-card" style="border-left: 5px solid {border_color};">'
+        f'<div class="metric-icon">{icon}</div>'
+        f'<div class="metric-title">{title}</div>'
+        f'<div class="metric-value">{value}</div>'
+        f'<div class="metric-status {status_class}">{emoji} {status_text}</div>'
+        '</div>'
+    )
+
 # Helper function to get status info
 def get_status_info(value, thresholds, lower_is_better=False):
     """Return plain English status text, CSS class, and emoji"""
@@ -302,31 +332,62 @@ def get_status_info(value, thresholds, lower_is_better=False):
         else:
             return "Needs Work", "status-needs-work", "🔴", 35
 
-@st.cache_data(ttl=1800)
-def load_and_process_data(file_bytes):
-    """Load CSV and compute all metrics"""
-    start_time = time.time()
-    
-    df = pd.read_csv(pd.io.common.BytesIO(file_bytes))
+def read_csv_bytes(file_bytes):
+    """Parse CSV bytes with the multithreaded pyarrow reader, falling back to pandas' own parser"""
+    try:
+        return pd.read_csv(pd.io.common.BytesIO(file_bytes), engine="pyarrow")
+    except (ImportError, ValueError):
+        # pyarrow missing or unable to parse this file (ragged rows, odd quoting, ...)
+        return pd.read_csv(pd.io.common.BytesIO(file_bytes))
+
+@st.cache_data(ttl=1800, show_spinner=False)
+def load_csv(file_digest, _file_bytes):
+    """Parse the upload once and map its columns to the internal names (cached on the digest)"""
+    df = read_csv_bytes(_file_bytes)
     
     # 1. Clean column names (standardize)
     df.columns = df.columns.str.strip().str.lower().str.replace(' ', '_').str.replace('(', '').str.replace(')', '').str.replace('/', '_').str.replace('.', '').str.replace('£', '£')
     
     # 2. Rename columns using the mapping to match internal logic
-    df = df.rename(columns=COLUMN_MAPPING)
+    return df.rename(columns=COLUMN_MAPPING)
+
+@st.cache_data(ttl=1800, show_spinner="📊 Calculating ESG scores...")
+def load_and_process_data(file_digest, _file_bytes):
+    """Load CSV and compute all metrics and ESG scores (only depends on the upload)"""
+    start_time = time.time()
+    
+    df = load_csv(file_digest, _file_bytes)
     
     # 3. Handle Missing IDs
     if 'farm_id' not in df.columns and 'farm_name' in df.columns:
-        df['farm_id'] = df.apply(lambda x: f"{str(x['farm_name'])[:3].upper()}-{hash(str(x['farm_name'])) % 1000:03d}", axis=1)
+        # Build one ID per distinct farm name, then map it onto the rows
+        farm_ids = {
+            name: f"{str(name)[:3].upper()}-{hash(str(name)) % 1000:03d}"
+            for name in df['farm_name'].unique()
+        }
+        df['farm_id'] = df['farm_name'].map(farm_ids)
     
     # Compute
     df = compute_kpis(df)
     farm_df = aggregate_to_farm_level(df)
+    # Index by farm so picking a farm is an index lookup rather than a full-column scan
+    esg_df = compute_esg_scores(farm_df).set_index('farm_id', drop=False).rename_axis(None).sort_index()
+    
+    # Peer averages per year for the comparison chart, so picking a farm doesn't re-aggregate
+    peer_avg_df = esg_df.groupby('year')[['esg_score', 'e_score', 's_score', 'g_score']].mean()
+    peer_avg_df['n_farms'] = esg_df.groupby('year').size()
     
     load_time = time.time() - start_time
-    return df, farm_df, load_time
+    return df, esg_df, peer_avg_df, load_time
 
+def render_insights_html(insights):
+    """Build the insights block HTML in a single string join"""
+    items = ''.join(f'<div class="insight-item"><p>{insight}</p></div>' for insight in insights)
+    return f'<div class="insights-container">{items}</div>'
+
+@st.cache_resource
 def get_base64_image(image_path):
+    """Read and base64-encode a static asset once per process"""
     try:
         with open(image_path, "rb") as f:
             data = f.read()
@@ -334,6 +395,14 @@ def get_base64_image(image_path):
     except Exception:
         return None
 
+@st.cache_resource
+def get_icon_html(image_path):
+    """Build the header <img> data-URI tag once, or fall back to an emoji if the file is missing"""
+    icon_base64 = get_base64_image(image_path)
+    if icon_base64:
+        return f'<img src="data:image/png;base64,{icon_base64}" style="height: 50px; vertical-align: middle; margin-bottom: 8px; margin-right: 10px;">'
+    return "🌾"
+
 
 # Sidebar
 with st.sidebar:
@@ -431,17 +500,16 @@ if uploaded_file is None:
 # Load and validate data
 file_bytes = uploaded_file.getvalue()
 
+# Hash the upload once per file; the cached loaders key on this digest instead of
+# rehashing the whole file on every rerun
+if st.session_state.get('upload_file_id') != uploaded_file.file_id:
+    st.session_state['upload_file_id'] = uploaded_file.file_id
+    st.session_state['upload_digest'] = hashlib.sha1(file_bytes).hexdigest()
+file_digest = st.session_state['upload_digest']
+
 try:
-    # First pass to check columns - MIMIC THE LOADING LOGIC to valid columns correctly
-    raw_df = pd.read_csv(pd.io.common.BytesIO(file_bytes))
-    
-    # 1. Clean
-    raw_df.columns = raw_df.columns.str.strip().str.lower().str.replace(' ', '_').str.replace('(', '').str.replace(')', '').str.replace('/', '_').str.replace('.', '').str.replace('£', '£')
-    
-    # 2. Rename using Mapping
-    raw_df = raw_df.rename(columns=COLUMN_MAPPING)
-    
-    current_cols = raw_df.columns.tolist()
+    # First pass to check columns - shares the cached parse with load_and_process_data
+    current_cols = load_csv(file_digest, file_bytes).columns.tolist()
     
     # Validate Required (using internal names now)
     missing_required = [
@@ -470,7 +538,7 @@ try:
         st.info("💡 **Tip:** Adding optional fields like yield and soil tests improves insight and strengthens your sustainability profile.")
     
     # Process data
-    df, farm_df, load_time = load_and_process_data(file_bytes)
+    df, esg_df, peer_avg_df, load_time = load_and_process_data(file_digest, file_bytes)
 
 except Exception as e:
     st.error("### ⚠️ File Problem")
@@ -478,10 +546,6 @@ except Exception as e:
     # st.code(str(e)) # Uncomment to debug
     st.stop()
 
-# Compute ESG scores
-with st.spinner("📊 Calculating ESG scores..."):
-    esg_df = compute_esg_scores(farm_df)
-
 # Sidebar filters
 with st.sidebar:
     st.markdown("### 🔍 Filters")
@@ -501,11 +565,14 @@ with st.sidebar:
     else:
         selected_years = st.multiselect("Select Years", years, default=years)
 
-# Filter data
-filtered_esg = esg_df[
-    (esg_df['farm_id'] == selected_farm) & 
-    (esg_df['year'].isin(selected_years))
-]
+# Filter data - index the selected farm's rows by year so later lookups are direct
+farm_history = (
+    esg_df.loc[[selected_farm]]
+    .drop_duplicates('year')
+    .set_index('year', drop=False)
+    .sort_index()
+)
+filtered_esg = farm_history[farm_history.index.isin(selected_years)]
 
 if filtered_esg.empty:
     st.warning("No data for selected filters")
@@ -513,26 +580,21 @@ if filtered_esg.empty:
 
 # Get current year data
 if view_mode == "Current Year Snapshot":
-    my_farm = filtered_esg.iloc[0]
     current_year = selected_year
 else:
-    latest = filtered_esg[filtered_esg['year'] == max(selected_years)].iloc[0]
-    my_farm = latest
-    current_year = max(selected_years)
+    current_year = filtered_esg.index.max()
+my_farm = filtered_esg.loc[current_year]
 
 # === HERO SECTION / HEADER ===
-# Load the icon
-icon_path = "assets/agriesg_icon.png" # Ensure this path matches exactly
-icon_base64 = get_base64_image(icon_path)
-
-# Build the image tag or fallback to emoji if file missing
-if icon_base64:
-    icon_html = f'<img src="data:image/png;base64,{icon_base64}" style="height: 50px; vertical-align: middle; margin-bottom: 8px; margin-right: 10px;">'
-else:
-    icon_html = "🌾" # Fallback if image not found
-
-st.markdown(f'<h1 class="main-title">{icon_html} AgriESG Dashboard</h1>', unsafe_allow_html=True)
-st.markdown('<p class="subtitle">Simple insights for better farming</p>', unsafe_allow_html=True)
+# Load the icon (encoded once per process, not on every rerun).
+# The header uses a pre-sized 128px copy: it is drawn 50px high, and the full
+# 1024px icon would inline ~2MB of base64 into the page
+icon_html = get_icon_html("assets/agriesg_icon_header.png") # Ensure this path matches exactly
+
+st.html(
+    f'<h1 class="main-title">{icon_html} AgriESG Dashboard</h1>'
+    '<p class="subtitle">Simple insights for better farming</p>'
+)
 st.markdown("---")
 
 gauge_fig = create_gauge_chart(
@@ -555,17 +617,15 @@ else:
     message = "🔴 Needs Work. Let's improve your practices."
     color = "#c62828"
 
-st.markdown(f'''
+st.html(f'''
 <div class="hero-section">
     <p class="score-message" style="color: {color}; margin: 0;">{message}</p>
 </div>
-''', unsafe_allow_html=True)
+''')
 
 # === QUICK STATS ===
 st.markdown('<h2 class="section-title">Quick Stats</h2>', unsafe_allow_html=True)
 
-col1, col2, col3, col4 = st.columns(4)
-
 total_area = my_farm['total_farm_area_ha']
 emissions_per_ha = my_farm['emissions_per_ha']
 n_per_ha = my_farm['n_per_ha']
@@ -573,54 +633,19 @@ n_per_ha = my_farm['n_per_ha']
 sfi_cols = ['sfi_soil_compliance_rate', 'sfi_nutrient_compliance_rate', 'sfi_hedgerow_compliance_rate']
 sfi_avg = sum(my_farm.get(c, 0) for c in sfi_cols) / 3 * 100
 
-with col1:
-    st.markdown(f'''
-    <div class="metric-card" style="border-left: 5px solid #4a7c29;">
-        <div class="metric-icon">🌾</div>
-        <div class="metric-title">Total Farm Area</div>
-        <div class="metric-value">{total_area:.1f} ha</div>
-        <div class="metric-status status-on-track">✔️ On track</div>
-    </div>
-    ''', unsafe_allow_html=True)
-
-with col2:
-    status_text, status_class, emoji, norm_score = get_status_info(
-        emissions_per_ha, {'excellent': 30, 'good': 50}, lower_is_better=True
-    )
-    st.markdown(f'''
-    <div class="metric-card" style="border-left: 5px solid {'#4a7c29' if 'healthy' in status_class or 'low' in status_class else '#c62828'};">
-        <div class="metric-icon">🌫️</div>
-        <div class="metric-title">Emissions</div>
-        <div class="metric-value">{emissions_per_ha:.0f} kg/ha</div>
-        <div class="metric-status {status_class}">{emoji} {status_text}</div>
-    </div>
-    ''', unsafe_allow_html=True)
-
-with col3:
-    status_text, status_class, emoji, norm_score = get_status_info(
-        n_per_ha, {'excellent': 50, 'good': 100}, lower_is_better=True
-    )
-    st.markdown(f'''
-    <div class="metric-card" style="border-left: 5px solid {'#4a7c29' if 'healthy' in status_class or 'low' in status_class else '#c62828'};">
-        <div class="metric-icon">🧪</div>
-        <div class="metric-title">Nitrogen Use</div>
-        <div class="metric-value">{n_per_ha:.0f} kg/ha</div>
-        <div class="metric-status {status_class}">{emoji} {status_text}</div>
-    </div>
-    ''', unsafe_allow_html=True)
-
-with col4:
-    status_text, status_class, emoji, norm_score = get_status_info(
-        sfi_avg, {'excellent': 80, 'good': 50}
-    )
-    st.markdown(f'''
-    <div class="metric-card" style="border-left: 5px solid {'#4a7c29' if 'healthy' in status_class else '#c62828'};">
-        <div class="metric-icon">📋</div>
-        <div class="metric-title">Compliance</div>
-        <div class="metric-value">{sfi_avg:.0f}%</div>
-        <div class="metric-status {status_class}">{emoji} {status_text}</div>
-    </div>
-    ''', unsafe_allow_html=True)
+# All four cards go out together in a single st.html element
+emissions_status = get_status_info(emissions_per_ha, {'excellent': 30, 'good': 50}, lower_is_better=True)
+nitrogen_status = get_status_info(n_per_ha, {'excellent': 50, 'good': 100}, lower_is_better=True)
+compliance_status = get_status_info(sfi_avg, {'excellent': 80, 'good': 50})
+
+metric_cards = [
+    create_metric_card("🌾", "Total Farm Area", f"{total_area:.1f} ha",
+                       ("On track", "status-on-track", "✔️", None), border_color="#4a7c29"),
+    create_metric_card("🌫️", "Emissions", f"{emissions_per_ha:.0f} kg/ha", emissions_status),
+    create_metric_card("🧪", "Nitrogen Use", f"{n_per_ha:.0f} kg/ha", nitrogen_status),
+    create_metric_card("📋", "Compliance", f"{sfi_avg:.0f}%", compliance_status),
+]
+st.html(f'<div class="metric-row">{"".join(metric_cards)}</div>')
 
 st.markdown("---")
 
@@ -644,12 +669,8 @@ with st.spinner(f"🤖 Generating advice for {greeting_name}..."):
         farmer_name=greeting_name 
     )
 
-insights_html = '<div class="insights-container">'
-for insight in insights:
-    insights_html += f'<div class="insight-item"><p>{insight}</p></div>'
-insights_html += '</div>'
-
-st.markdown(insights_html, unsafe_allow_html=True)
+# st.html skips the markdown parser and sanitises the model's text
+st.html(render_insights_html(insights))
 
 st.markdown("---")
 
@@ -669,28 +690,28 @@ with tab1:
         st.plotly_chart(pie_fig, use_container_width=True)
     with col2:
         st.markdown("### Farm Performance Comparison")
-        all_farms = esg_df[esg_df['year'] == current_year]
-        comparison_fig = create_comparison_bar(my_farm, all_farms)
+        year_peers = peer_avg_df.loc[current_year]
+        comparison_fig = create_comparison_bar(my_farm, year_peers if year_peers['n_farms'] >= 2 else None)
         st.plotly_chart(comparison_fig, use_container_width=True)
 
 with tab2:
     col1, col2 = st.columns([2, 1])
     with col1:
         st.markdown("### Emissions by Source")
-        donut_fig = create_emissions_donut(
-            fertilizer=my_farm['emissions_fertilizer'],
-            diesel=my_farm['emissions_diesel'],
-            electricity=0
-        )
+        donut_fig = create_emissions_donut(**emissions_by_source(my_farm), electricity=0)
         st.plotly_chart(donut_fig, use_container_width=True)
     with col2:
         st.metric("Total Emissions", f"{my_farm['total_emissions']:.0f} kg CO₂e")
 
+# Built once here and reused by the PDF export below
+line_fig = None
+if len(selected_years) > 1 and view_mode == "Multi-Year Progress":
+    hist_data = [{"year": y, "esg_score": filtered_esg.at[y, 'esg_score']} for y in filtered_esg.index]
+    line_fig = create_progress_line_chart(hist_data)
+
 with tab3:
-    if len(selected_years) > 1 and view_mode == "Multi-Year Progress":
+    if line_fig is not None:
         st.markdown("### Progress Over Time")
-        hist_data = [{"year": y, "esg_score": filtered_esg[filtered_esg['year']==y].iloc[0]['esg_score']} for y in selected_years]
-        line_fig = create_progress_line_chart(hist_data)
         st.plotly_chart(line_fig, use_container_width=True)
     else:
         st.info("Select 'Multi-Year Progress' to see trends.")
@@ -704,31 +725,16 @@ st.markdown('<h2 class="section-title">Download Your Report</h2>', unsafe_allow_
 
 col1, col2 = st.columns(2)
 
-# Prepare the greeting name based on Farm Name (matching AI insights logic)
-greeting_name = my_farm.get('farm_name', 'Farm Team')
-
 with col1:
     if st.button("Download PDF Report", type="primary", use_container_width=True):
         with st.spinner("🔄 Generating PDF..."):
-            from utils.pdf_report import generate_pdf_report
+            from utils.pdf_report import generate_pdf_report_bytes
             
-            # Get current line chart if multi-year
-            line_fig_for_pdf = None
-            if view_mode == "Multi-Year Progress" and len(selected_years) > 1:
-                historical_data = []
-                for year in sorted(selected_years):
-                    year_data = filtered_esg[filtered_esg['year'] == year]
-                    if not year_data.empty:
-                        historical_data.append({
-                            'year': year,
-                            'esg_score': year_data.iloc[0]['esg_score']
-                        })
-                
-                if len(historical_data) > 1:
-                    line_fig_for_pdf = create_progress_line_chart(historical_data)
+            # Reuse the progress chart when there is more than one year to show
+            line_fig_for_pdf = line_fig if len(filtered_esg) > 1 else None
             
-            # Generate PDF
-            pdf_buffer = generate_pdf_report(
+            # Generate PDF (cached per farm, year, chart set and report date)
+            pdf_bytes = generate_pdf_report_bytes(
                 farm_data=my_farm,
                 farmer_name=greeting_name, 
                 year=current_year,
@@ -737,12 +743,13 @@ with col1:
                 pie_fig=pie_fig,
                 donut_fig=donut_fig,
                 bar_fig=comparison_fig,
-                line_fig=line_fig_for_pdf
+                line_fig=line_fig_for_pdf,
+                report_date=date.today()
             )
             
             st.download_button(
                 label="Download PDF",
-                data=pdf_buffer,
+                data=pdf_bytes,
                 file_name=f"farm_{selected_farm}_esg_report_{current_year}.pdf",
                 mime="application/pdf",
                 use_container_width=True
@@ -2,8 +2,51 @@ from langchain_google_genai import ChatGoogleGenerativeAI
 from langchain_core.prompts import ChatPromptTemplate
 import streamlit as st
 import os
+import re
+
+# Leading bullets/numbering on a response line, and the greeting line itself
+_BULLET_RE = re.compile(r'^[•\-*1-9. ]+')
+_GREETING_RE = re.compile(r'^(?:hello|hi |dear|greetings)', re.IGNORECASE)
+
+# Prompt is parsed once at import; the farm values are filled in per call.
+# We explicitly tell the AI to use the Farm Name in the greeting
+PROMPT = ChatPromptTemplate.from_messages([
+    ("system", """You are a helpful farming advisor speaking to the team at {greeting_name}.
+
+Rules:
+- ALWAYS start your response with exactly: "Hello {greeting_name}!"
+- Then provide 3-4 simple, actionable tips to improve their sustainability.
+- Use SIMPLE words (plain English).
+- NO technical jargon (say "soil health" instead of "agronomic substrate analysis").
+- Focus on practical wins: saving money on fertilizer, improving soil, or safety.
+- If their score is low, be encouraging. If high, say "Keep it up!".
+
+Example Output Format:
+Hello {greeting_name}!
+Try using less fertilizer on the North Field to save costs.
+Planting cover crops this winter could help your soil health.
+Your safety record is great—keep checking those machinery logs.
+"""),
+    
+    ("user", """Farm Data:
+- Overall Sustainability Score: {esg_score}/100
+- Environment Score: {e_score}/100 
+- Social Score: {s_score}/100
+- Emissions: {emissions_per_ha} kg/ha (Lower is better)
+- Yield Estimate: {yield_per_ha} tons/ha
+
+Give me a simple list of advice.""")
+])
+
+@st.cache_resource
+def get_llm(api_key: str) -> ChatGoogleGenerativeAI:
+    """Create the Gemini client once per API key and share it across reruns and sessions"""
+    return ChatGoogleGenerativeAI(
+        model="gemini-2.5-flash-lite", 
+        temperature=0.7,
+        google_api_key=api_key
+    )
 
-@st.cache_data(ttl=3600)  # Cache for 1 hour
 def generate_ai_insights(
     esg_score: float,
     e_score: float,
@@ -19,12 +62,41 @@ def generate_ai_insights(
     """
     Generate AI-powered, farmer-friendly insights using Gemini.
     Note: 'farmer_name' argument now receives the Farm Name from app.py.
+    Inputs are normalised here so the same farm state always hits the cache.
     """
+    # Clean up the name (None, '' and NaN all become the generic greeting)
+    greeting_name = str(farmer_name) if farmer_name and str(farmer_name).lower() != 'nan' else "Farm Team"
+    
+    return _generate_ai_insights(
+        esg_score=round(float(esg_score), 1),
+        e_score=round(float(e_score), 1),
+        s_score=round(float(s_score), 1),
+        emissions_per_ha=round(float(emissions_per_ha), 1),
+        emissions_per_tonne=round(float(emissions_per_tonne), 1),
+        yield_per_ha=round(float(yield_per_ha), 1),
+        female_share=round(float(female_share), 1),
+        accidents=round(float(accidents), 1),
+        farm_id=str(farm_id),
+        greeting_name=greeting_name
+    )
+
+@st.cache_data(ttl=3600)  # Cache for 1 hour
+def _generate_ai_insights(
+    esg_score: float,
+    e_score: float,
+    s_score: float,
+    emissions_per_ha: float,
+    emissions_per_tonne: float,
+    yield_per_ha: float,
+    female_share: float,
+    accidents: float,
+    farm_id: str,
+    greeting_name: str
+) -> list[str]:
+    """Cached Gemini call; expects the normalised values from generate_ai_insights."""
     
     # Check if API key exists
     api_key = os.getenv("GOOGLE_API_KEY")
-    # Clean up the name (if it's just 'Farm', treat as generic)
-    greeting_name = str(farmer_name) if farmer_name and str(farmer_name).lower() != 'nan' else "Farm Team"
     
     if not api_key:
         return [
@@ -32,49 +104,19 @@ def generate_ai_insights(
             "Check your .env file for GOOGLE_API_KEY configuration."
         ]
     
-    # Create prompt template
-    # We explicitly tell the AI to use the Farm Name in the greeting
-    prompt = ChatPromptTemplate.from_messages([
-        ("system", f"""You are a helpful farming advisor speaking to the team at {greeting_name}.
-
-Rules:
-- ALWAYS start your response with exactly: "Hello {greeting_name}!"
-- Then provide 3-4 simple, actionable tips to improve their sustainability.
-- Use SIMPLE words (plain English).
-- NO technical jargon (say "soil health" instead of "agronomic substrate analysis").
-- Focus on practical wins: saving money on fertilizer, improving soil, or safety.
-- If their score is low, be encouraging. If high, say "Keep it up!".
-
-Example Output Format:
-Hello {greeting_name}!
-Try using less fertilizer on the North Field to save costs.
-Planting cover crops this winter could help your soil health.
-Your safety record is great—keep checking those machinery logs.
-"""),
-        
-        ("user", f"""Farm Data:
-- Overall Sustainability Score: {esg_score}/100
-- Environment Score: {e_score}/100 
-- Social Score: {s_score}/100
-- Emissions: {emissions_per_ha} kg/ha (Lower is better)
-- Yield Estimate: {yield_per_ha:.1f} tons/ha
-
-Give me a simple list of advice.""")
-    ])
-    
     try:
-        # Initialize LLM
-        llm = ChatGoogleGenerativeAI(
-            model="gemini-2.5-flash-lite", 
-            temperature=0.7,
-            google_api_key=api_key
-        )
-        
-        # Create chain
-        chain = prompt | llm
+        # Reuse the process-wide client and the prebuilt prompt
+        chain = PROMPT | get_llm(api_key)
         
         # Invoke
-        response = chain.invoke({})
+        response = chain.invoke({
+            "greeting_name": greeting_name,
+            "esg_score": esg_score,
+            "e_score": e_score,
+            "s_score": s_score,
+            "emissions_per_ha": emissions_per_ha,
+            "yield_per_ha": f"{yield_per_ha:.1f}",
+        })
         
         # Parse response into list
         content = response.content.strip()
@@ -83,10 +125,10 @@ Give me a simple list of advice.""")
         for line in content.split('\n'):
             line = line.strip()
             # Remove bullet points or numbering
-            clean_line = line.lstrip('•-*123456789. ')
+            clean_line = _BULLET_RE.sub('', line)
             
             # Check if it's the greeting or a substantial tip
-            is_greeting = clean_line.lower().startswith(('hello', 'hi ', 'dear', 'greetings'))
+            is_greeting = _GREETING_RE.match(clean_line) is not None
             
             if clean_line and (len(clean_line) > 10 or is_greeting):
                 insights.append(clean_line)
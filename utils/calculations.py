@@ -4,278 +4,308 @@ import numpy as np
 # Emission factors (UK agriculture standards)
 EF_N = 5.5  # kg CO2e per kg N fertilizer
 EF_DIESEL = 2.7  # kg CO2e per litre diesel
+EMISSION_FACTORS = np.array([EF_N, EF_DIESEL])  # in [fertiliser_kgN, diesel_litres] order
+
+# Yes/No columns converted to 0/1 in compute_kpis
+# Standardize column names to match the cleaned version in app.py
+YES_NO_COLS = [
+    'pesticide_applied_yes_no', 'irrigation_applied_yes_no',
+    'livestock_present_yes_no', 'sfi_soil_standard_yes_no',
+    'sfi_nutrient_management_yes_no', 'sfi_hedgerows_yes_no',
+    # Optional columns, processed if present
+    'cover_crop_planted_yes_no',
+    'reduced_tillage_yes_no',
+    'integrated_pest_management_yes_no',
+    'labour_hs_training_done_yes_no',
+    'worker_contracts_formalised_yes_no',
+    'soil_test_conducted_yes_no'
+]
+
+# Lower-cased values counted as "Yes" (Yes, yes, True, 1)
+_TRUE_TOKENS = frozenset(['yes', 'true', '1'])
+
+def yes_no_to_binary(series: pd.Series) -> pd.Series:
+    """
+    Convert a Yes/No style column to 0/1 (int8).
+    Only the distinct values are lower-cased and checked, then mapped back to rows by code.
+    """
+    codes, uniques = pd.factorize(series)
+    is_yes = pd.Index(uniques).astype(str).str.lower().isin(_TRUE_TOKENS)
+    # factorize gives missing values the code -1, which picks the trailing False
+    binary = np.append(is_yes, False)[codes]
+    return pd.Series(binary.astype('int8'), index=series.index)
+
+def emissions_by_source(row) -> dict:
+    """
+    Split a farm row's emissions (kg CO2e) into fertiliser and diesel.
+    Keys match the create_emissions_donut arguments.
+    """
+    return {
+        'fertilizer': row['fertiliser_kgN'] * EF_N,
+        'diesel': row['diesel_litres'] * EF_DIESEL
+    }
 
 def compute_kpis(df: pd.DataFrame) -> pd.DataFrame:
     """
     Compute KPIs at field-month level.
     Handles optional columns gracefully by checking existence first.
     """
-    df = df.copy()
+    cols = set(df.columns)
+    
+    # New frame for the KPI columns; the input's columns are shared, not copied,
+    # and the caller's frame isn't mutated
+    df = df.copy(deep=False)
     
-    # Replace zeros with NaN for proper calculation (avoid division by zero)
-    df['field_area_ha'] = df['field_area_ha'].replace(0, np.nan)
+    # Zero areas become NaN in a local divisor (avoid division by zero),
+    # leaving field_area_ha itself as uploaded
+    area = df['field_area_ha'].to_numpy(dtype=float, copy=True)
+    area[area == 0] = np.nan
     
     # === Field-level calculations ===
     
     # Nitrogen (REQUIRED - assumes column exists)
-    df['n_per_ha'] = df['fertiliser_kgN'] / df['field_area_ha']
+    df['n_per_ha'] = df['fertiliser_kgN'] / area
     
     # Phosphate & Potash (RECOMMENDED - Check existence)
-    if 'fertiliser_kgP2O5' in df.columns:
-        df['p_per_ha'] = df['fertiliser_kgP2O5'] / df['field_area_ha']
+    if 'fertiliser_kgP2O5' in cols:
+        df['p_per_ha'] = df['fertiliser_kgP2O5'] / area
         
-    if 'fertiliser_kgK2O' in df.columns:
-        df['k_per_ha'] = df['fertiliser_kgK2O'] / df['field_area_ha']
+    if 'fertiliser_kgK2O' in cols:
+        df['k_per_ha'] = df['fertiliser_kgK2O'] / area
     
     # Emissions (kg CO2e) - Nitrogen and Diesel are REQUIRED
-    emissions_fertilizer = df['fertiliser_kgN'] * EF_N
-    emissions_diesel = df['diesel_litres'] * EF_DIESEL
+    # One matrix-vector product over the raw inputs gives the total in a single pass.
+    # The per-source split is only charted for one farm-year, so it is derived there
+    # from the summed inputs instead of being stored for every row
+    total_emissions = df[['fertiliser_kgN', 'diesel_litres']].to_numpy(dtype=float) @ EMISSION_FACTORS
     
-    df['emissions_fertilizer'] = emissions_fertilizer
-    df['emissions_diesel'] = emissions_diesel
-    df['total_emissions'] = emissions_fertilizer + emissions_diesel
-    df['emissions_per_ha'] = df['total_emissions'] / df['field_area_ha']
+    df['total_emissions'] = total_emissions
+    df['emissions_per_ha'] = total_emissions / area
     
     # Labour intensity (RECOMMENDED - Check existence)
-    if 'labour_hours' in df.columns:
-        df['labour_hours_per_ha'] = df['labour_hours'] / df['field_area_ha']
+    if 'labour_hours' in cols:
+        df['labour_hours_per_ha'] = df['labour_hours'] / area
         
     # Yield (RECOMMENDED)
-    if 'yield_tons' in df.columns:
-        df['yield_per_ha'] = df['yield_tons'] / df['field_area_ha']
-    
-    # Convert yes/no to binary for aggregation
-    # Standardize column names to match the cleaned version in app.py
-    yes_no_cols = [
-        'pesticide_applied_yes_no', 'irrigation_applied_yes_no',
-        'livestock_present_yes_no', 'sfi_soil_standard_yes_no',
-        'sfi_nutrient_management_yes_no', 'sfi_hedgerows_yes_no'
-    ]
-    
-    for col in yes_no_cols:
-        if col in df.columns:
-            # Handle various Yes/No formats (Yes, yes, True, 1)
-            df[col + '_binary'] = df[col].astype(str).str.lower().isin(['yes', 'true', '1']).astype(int)
+    if 'yield_tons' in cols:
+        df['yield_per_ha'] = df['yield_tons'] / area
+    
+    # Convert yes/no to binary for aggregation.
+    # All present columns are converted in one pass and joined in a single concat
+    # instead of growing the frame one column at a time
+    present = [col for col in YES_NO_COLS if col in cols]
+    binaries = pd.DataFrame(
+        {col + '_binary': yes_no_to_binary(df[col]) for col in present},
+        index=df.index
+    )
+    df = pd.concat([df, binaries], axis=1)
     
-    # Process optional columns if present
-    optional_yes_no_cols = [
-        'cover_crop_planted_yes_no',
-        'reduced_tillage_yes_no',
-        'integrated_pest_management_yes_no',
-        'labour_hs_training_done_yes_no',
-        'worker_contracts_formalised_yes_no',
-        'soil_test_conducted_yes_no'
-    ]
+    # Descriptive text repeats across months and fields, so store it as categories.
+    # farm_name stays as-is because it is a groupby key for aggregation
+    for col in ['farmer_name', 'field_name', 'crop_type', 'soil_type']:
+        if col in cols:
+            df[col] = df[col].astype('category')
     
-    for col in optional_yes_no_cols:
-        if col in df.columns:
-            df[col + '_binary'] = df[col].astype(str).str.lower().isin(['yes', 'true', '1']).astype(int)
+    # Farm metrics carry a few significant figures at most, so float32 is plenty
+    # and halves the memory every later groupby/rank has to walk
+    float_cols = df.select_dtypes(include='float64').columns
+    df[float_cols] = df[float_cols].astype('float32')
     
     return df
 
+# Base aggregation dictionary (Required columns)
+BASE_AGG = {
+    # Area metrics
+    'field_area_ha': 'sum',
+    
+    # Intensity metrics (weighted by area)
+    'n_per_ha': 'mean',
+    'emissions_per_ha': 'mean',
+    
+    # Total emissions and the inputs behind them
+    'total_emissions': 'sum',
+    'fertiliser_kgN': 'sum',
+    'diesel_litres': 'sum',
+    
+    # Practices (% of fields)
+    'pesticide_applied_yes_no_binary': 'mean',
+    'irrigation_applied_yes_no_binary': 'mean',
+    'livestock_present_yes_no_binary': 'mean',
+}
+
+# RECOMMENDED/OPTIONAL columns, aggregated only when present
+OPTIONAL_AGG = {
+    'p_per_ha': 'mean',
+    'k_per_ha': 'mean',
+    'labour_hours_per_ha': 'mean',
+    'yield_tons': 'sum',
+    'selling_price_per_ton': 'mean',
+    
+    # Optional Numeric
+    'soil_organic_matter_pct': 'mean',
+    'soil_ph': 'mean',
+    'hedgerow_length_m': 'sum',
+    'wildflower_area_ha': 'sum',
+    'buffer_strip_area_ha': 'sum',
+    'trees_planted_count': 'sum',
+    'water_volume_m3': 'sum',
+    
+    # Optional Binaries (SFI and others), if compute_kpis created them
+    'sfi_soil_standard_yes_no_binary': 'mean',
+    'sfi_nutrient_management_yes_no_binary': 'mean',
+    'sfi_hedgerows_yes_no_binary': 'mean',
+    'cover_crop_planted_yes_no_binary': 'mean',
+    'reduced_tillage_yes_no_binary': 'mean',
+    'integrated_pest_management_yes_no_binary': 'mean',
+    'labour_hs_training_done_yes_no_binary': 'mean',
+    'worker_contracts_formalised_yes_no_binary': 'mean',
+    'soil_test_conducted_yes_no_binary': 'mean',
+}
+
+# Rename for clarity
+FARM_LEVEL_RENAME = {
+    'field_area_ha': 'total_farm_area_ha',
+    'pesticide_applied_yes_no_binary': 'pesticide_use_rate',
+    'irrigation_applied_yes_no_binary': 'irrigation_rate',
+    'livestock_present_yes_no_binary': 'livestock_presence',
+    'sfi_soil_standard_yes_no_binary': 'sfi_soil_compliance_rate',
+    'sfi_nutrient_management_yes_no_binary': 'sfi_nutrient_compliance_rate',
+    'sfi_hedgerows_yes_no_binary': 'sfi_hedgerow_compliance_rate',
+    'cover_crop_planted_yes_no_binary': 'cover_crop_rate',
+    'reduced_tillage_yes_no_binary': 'reduced_tillage_rate',
+    'integrated_pest_management_yes_no_binary': 'ipm_rate',
+    'labour_hs_training_done_yes_no_binary': 'safety_training_rate',
+    'worker_contracts_formalised_yes_no_binary': 'contract_rate',
+    'soil_test_conducted_yes_no_binary': 'soil_test_rate'
+}
+
 def aggregate_to_farm_level(df: pd.DataFrame) -> pd.DataFrame:
     """
     Aggregate field-level data to farm-year level for ESG scoring.
     Only aggregates columns that actually exist.
     """
-    # Base aggregation dictionary (Required columns)
-    agg_dict = {
-        # Area metrics
-        'field_area_ha': 'sum',
-        
-        # Intensity metrics (weighted by area)
-        'n_per_ha': 'mean',
-        'emissions_per_ha': 'mean',
-        
-        # Total emissions
-        'total_emissions': 'sum',
-        'emissions_fertilizer': 'sum',
-        'emissions_diesel': 'sum',
-        
-        # Practices (% of fields)
-        'pesticide_applied_yes_no_binary': 'mean',
-        'irrigation_applied_yes_no_binary': 'mean',
-        'livestock_present_yes_no_binary': 'mean',
-    }
-    
-    # Conditionally add RECOMMENDED/OPTIONAL columns to aggregation
-    if 'p_per_ha' in df.columns:
-        agg_dict['p_per_ha'] = 'mean'
-    if 'k_per_ha' in df.columns:
-        agg_dict['k_per_ha'] = 'mean'
-    if 'labour_hours_per_ha' in df.columns:
-        agg_dict['labour_hours_per_ha'] = 'mean'
-    if 'yield_tons' in df.columns:
-        agg_dict['yield_tons'] = 'sum'
-    if 'selling_price_per_ton' in df.columns:
-        agg_dict['selling_price_per_ton'] = 'mean'
-        
-    # Optional Numeric
-    optional_numeric_cols = {
-        'soil_organic_matter_pct': 'mean',
-        'soil_ph': 'mean',
-        'hedgerow_length_m': 'sum',
-        'wildflower_area_ha': 'sum',
-        'buffer_strip_area_ha': 'sum',
-        'trees_planted_count': 'sum',
-        'water_volume_m3': 'sum',
-    }
-    
-    for col, func in optional_numeric_cols.items():
-        if col in df.columns:
-            agg_dict[col] = func
-
-    # Optional Binaries (SFI and others)
-    # We check if the binary version was created in compute_kpis
-    potential_binaries = [
-        'sfi_soil_standard_yes_no_binary',
-        'sfi_nutrient_management_yes_no_binary',
-        'sfi_hedgerows_yes_no_binary',
-        'cover_crop_planted_yes_no_binary',
-        'reduced_tillage_yes_no_binary',
-        'integrated_pest_management_yes_no_binary',
-        'labour_hs_training_done_yes_no_binary',
-        'worker_contracts_formalised_yes_no_binary',
-        'soil_test_conducted_yes_no_binary'
-    ]
-    
-    for col in potential_binaries:
-        if col in df.columns:
-            agg_dict[col] = 'mean'
+    cols = set(df.columns)
+    agg_dict = {**BASE_AGG, **{col: func for col, func in OPTIONAL_AGG.items() if col in cols}}
     
     # Group by farm and year
-    # App.py ensures farm_id exists, so this is safe
-    grouped = df.groupby(['farm_id', 'farm_name', 'year']).agg(agg_dict)
-    
-    # Rename for clarity
-    rename_dict = {
-        'field_area_ha': 'total_farm_area_ha',
-        'pesticide_applied_yes_no_binary': 'pesticide_use_rate',
-        'irrigation_applied_yes_no_binary': 'irrigation_rate',
-        'livestock_present_yes_no_binary': 'livestock_presence',
-        'sfi_soil_standard_yes_no_binary': 'sfi_soil_compliance_rate',
-        'sfi_nutrient_management_yes_no_binary': 'sfi_nutrient_compliance_rate',
-        'sfi_hedgerows_yes_no_binary': 'sfi_hedgerow_compliance_rate',
-        'cover_crop_planted_yes_no_binary': 'cover_crop_rate',
-        'reduced_tillage_yes_no_binary': 'reduced_tillage_rate',
-        'integrated_pest_management_yes_no_binary': 'ipm_rate',
-        'labour_hs_training_done_yes_no_binary': 'safety_training_rate',
-        'worker_contracts_formalised_yes_no_binary': 'contract_rate',
-        'soil_test_conducted_yes_no_binary': 'soil_test_rate'
-    }
+    # App.py ensures farm_id exists, so this is safe.
+    # Categorical keys let groupby bucket on integer codes instead of hashing every row's string
+    df = df.assign(
+        farm_id=df['farm_id'].astype('category'),
+        farm_name=df['farm_name'].astype('category')
+    )
+    grouped = df.groupby(['farm_id', 'farm_name', 'year'], observed=True).agg(agg_dict)
     
-    grouped = grouped.rename(columns=rename_dict)
+    grouped = grouped.rename(columns=FARM_LEVEL_RENAME)
     
     return grouped.reset_index()
 
+# Pillar weights for the overall score, in [e_score, s_score, g_score] order
+ESG_WEIGHTS = np.array([
+    0.5,  # 50% Environment
+    0.3,  # 30% Social
+    0.2   # 20% Governance
+])
+
+# ESG components: name -> (column, higher_is_better).
+# Optional columns are scored only when the upload provides them
+ENV_COMPONENTS = {
+    # Core environmental metrics (always present)
+    'emissions': ('emissions_per_ha', False),
+    'nitrogen': ('n_per_ha', False),
+    'pesticide': ('pesticide_use_rate', False),
+    # Optional environmental metrics
+    'hedgerows': ('hedgerow_length_m', True),
+    'soil_health': ('soil_organic_matter_pct', True),
+    'cover_crops': ('cover_crop_rate', True),
+    'tree_planting': ('trees_planted_count', True),
+    'soil_testing': ('soil_test_rate', True),
+}
+
+SOC_COMPONENTS = {
+    # Labour is RECOMMENDED, not required
+    'employment': ('labour_hours_per_ha', True),
+    'safety_training': ('safety_training_rate', True),
+    'worker_contracts': ('contract_rate', True),
+}
+
+GOV_COMPONENTS = {
+    # SFI columns are optional in the template
+    'sfi_soil': ('sfi_soil_compliance_rate', True),
+    'sfi_nutrient': ('sfi_nutrient_compliance_rate', True),
+    'sfi_hedgerow': ('sfi_hedgerow_compliance_rate', True),
+    'reduced_tillage': ('reduced_tillage_rate', True),
+    'ipm': ('ipm_rate', True),
+}
+
+def percentile_scores(df: pd.DataFrame, components: dict) -> pd.DataFrame:
+    """
+    Convert every present component column into 0-100 percentile scores.
+    All columns are ranked in one pass; columns with a single distinct value score a neutral 50.
+    """
+    cols = set(df.columns)
+    present = {name: spec for name, spec in components.items() if spec[0] in cols}
+    raw = df[[col for col, _ in present.values()]].set_axis(list(present), axis=1)
+    
+    ranks = raw.rank(pct=True).to_numpy()
+    higher_is_better = np.array([higher for _, higher in present.values()], dtype=bool)
+    scores = pd.DataFrame(
+        np.where(higher_is_better, ranks, 1 - ranks) * 100,
+        index=raw.index,
+        columns=raw.columns
+    ).round(1)
+    
+    # Equal values share a rank, so a column with at most one distinct value has no
+    # rank spread; this reuses the ranks instead of a separate nunique() pass.
+    # fmax/fmin skip NaN, and an all-NaN column compares False, i.e. constant
+    rank_max = np.fmax.reduce(ranks, axis=0, initial=np.nan)
+    rank_min = np.fmin.reduce(ranks, axis=0, initial=np.nan)
+    scores.loc[:, ~(rank_max > rank_min)] = 50
+    return scores
+
+def component_mean(scores: pd.DataFrame) -> np.ndarray:
+    """Average the component scores of each row, skipping NaN (NaN if a row has none)."""
+    values = scores.to_numpy(dtype=float)
+    counts = (~np.isnan(values)).sum(axis=1)
+    with np.errstate(invalid='ignore'):  # 0/0 for rows without any score
+        return np.nansum(values, axis=1) / counts
+
 def percentile_score(series: pd.Series, higher_is_better=True) -> pd.Series:
     """Convert a series into 0-100 percentile scores."""
-    s = series.copy()
-    
-    if s.dropna().nunique() <= 1:
-        return pd.Series(50, index=s.index)
-    
-    ranks = s.rank(pct=True)
-    
-    if higher_is_better:
-        score = ranks * 100
-    else:
-        score = (1 - ranks) * 100
-    
-    return score.round(1)
+    return percentile_scores(series.to_frame('score'), {'score': ('score', higher_is_better)})['score']
 
 def compute_esg_scores(df: pd.DataFrame) -> pd.DataFrame:
     """
     Compute ESG scores from aggregated farm-level data.
     Automatically handles missing columns by ignoring them in the average.
     """
-    result = df.copy()
-    
     # === ENVIRONMENT SCORE (50% weight) ===
-    env_components = {}
-    
-    # Core environmental metrics (always present)
-    env_components['emissions'] = percentile_score(result['emissions_per_ha'], higher_is_better=False)
-    env_components['nitrogen'] = percentile_score(result['n_per_ha'], higher_is_better=False)
-    env_components['pesticide'] = percentile_score(result['pesticide_use_rate'], higher_is_better=False)
-    
-    # Optional environmental metrics (Add only if they exist)
-    if 'hedgerow_length_m' in result.columns:
-        env_components['hedgerows'] = percentile_score(result['hedgerow_length_m'], higher_is_better=True)
-    
-    if 'soil_organic_matter_pct' in result.columns:
-        env_components['soil_health'] = percentile_score(result['soil_organic_matter_pct'], higher_is_better=True)
-    
-    if 'cover_crop_rate' in result.columns:
-        env_components['cover_crops'] = percentile_score(result['cover_crop_rate'], higher_is_better=True)
-    
-    if 'trees_planted_count' in result.columns:
-        env_components['tree_planting'] = percentile_score(result['trees_planted_count'], higher_is_better=True)
-        
-    if 'soil_test_rate' in result.columns:
-        env_components['soil_testing'] = percentile_score(result['soil_test_rate'], higher_is_better=True)
-    
-    # Calculate environment score
-    env_df = pd.DataFrame(env_components, index=result.index)
-    result['e_score'] = env_df.mean(axis=1)
+    env_df = percentile_scores(df, ENV_COMPONENTS)
+    e_score = component_mean(env_df)
     
     # === SOCIAL SCORE (30% weight) ===
-    soc_components = {}
-    
-    # Labour is now RECOMMENDED, not required. 
-    # If labour_hours_per_ha exists, use it.
-    if 'labour_hours_per_ha' in result.columns:
-        soc_components['employment'] = percentile_score(result['labour_hours_per_ha'], higher_is_better=True)
-    
-    # Optional social metrics
-    if 'safety_training_rate' in result.columns:
-        soc_components['safety_training'] = percentile_score(
-            result['safety_training_rate'], higher_is_better=True
-        )
-    
-    if 'contract_rate' in result.columns:
-        soc_components['worker_contracts'] = percentile_score(
-            result['contract_rate'], higher_is_better=True
-        )
+    soc_df = percentile_scores(df, SOC_COMPONENTS)
     
     # Calculate social score - Default to 50 if no data available
-    if len(soc_components) > 0:
-        soc_df = pd.DataFrame(soc_components, index=result.index)
-        result['s_score'] = soc_df.mean(axis=1)
+    if len(soc_df.columns) > 0:
+        s_score = component_mean(soc_df)
     else:
         # Neutral score if no social data provided
-        result['s_score'] = 50.0
+        s_score = 50.0
     
     # === GOVERNANCE SCORE (20% weight) ===
-    gov_components = {}
-    
-    # Check SFI columns (they are optional in template but handled in calc)
-    if 'sfi_soil_compliance_rate' in result.columns:
-        gov_components['sfi_soil'] = percentile_score(result['sfi_soil_compliance_rate'], higher_is_better=True)
-    if 'sfi_nutrient_compliance_rate' in result.columns:
-        gov_components['sfi_nutrient'] = percentile_score(result['sfi_nutrient_compliance_rate'], higher_is_better=True)
-    if 'sfi_hedgerow_compliance_rate' in result.columns:
-        gov_components['sfi_hedgerow'] = percentile_score(result['sfi_hedgerow_compliance_rate'], higher_is_better=True)
-    
-    # Optional governance metrics
-    if 'reduced_tillage_rate' in result.columns:
-        gov_components['reduced_tillage'] = percentile_score(result['reduced_tillage_rate'], higher_is_better=True)
+    gov_df = percentile_scores(df, GOV_COMPONENTS)
     
-    if 'ipm_rate' in result.columns:
-        gov_components['ipm'] = percentile_score(result['ipm_rate'], higher_is_better=True)
-    
-    # Calculate governance score
-    if len(gov_components) > 0:
-        gov_df = pd.DataFrame(gov_components, index=result.index)
-        result['g_score'] = gov_df.mean(axis=1)
+    if len(gov_df.columns) > 0:
+        g_score = component_mean(gov_df)
     else:
-        result['g_score'] = 50.0
+        g_score = 50.0
+    
+    # assign() returns a new frame that shares the input columns instead of deep-copying them
+    result = df.assign(e_score=e_score, s_score=s_score, g_score=g_score)
     
     # === OVERALL ESG SCORE ===
-    result['esg_score'] = (
-        result['e_score'] * 0.5 +  # 50% Environment
-        result['s_score'] * 0.3 +  # 30% Social
-        result['g_score'] * 0.2    # 20% Governance
-    )
+    # One weighted dot product over the three pillar columns
+    result['esg_score'] = result[['e_score', 's_score', 'g_score']].to_numpy(dtype=float) @ ESG_WEIGHTS
     
     return result
\ No newline at end of file
@@ -1,6 +1,8 @@
 import streamlit as st
 import pandas as pd
 import os
+from collections import deque
+from io import StringIO
 from datetime import date
 
 # Define where the logs will be saved locally
@@ -18,22 +20,31 @@ def init_log_file():
 
 def save_log_entry(entry_data):
     """Appends a new entry to the local CSV file."""
-    # Load existing
-    if os.path.exists(LOG_FILE):
-        df = pd.read_csv(LOG_FILE)
-    else:
-        df = pd.DataFrame(columns=entry_data.keys())
-    
     # Convert single entry to dataframe
     new_entry_df = pd.DataFrame([entry_data])
     
-    # Combine and save
-    updated_df = pd.concat([df, new_entry_df], ignore_index=True)
-    updated_df.to_csv(LOG_FILE, index=False)
-    return updated_df
+    # Append only the new row; write the header if the file is new or empty
+    write_header = not os.path.exists(LOG_FILE) or os.path.getsize(LOG_FILE) == 0
+    new_entry_df.to_csv(LOG_FILE, mode='a', header=write_header, index=False)
+    return new_entry_df
+
+@st.cache_data(show_spinner=False, max_entries=1)
+def load_recent_logs(mtime_ns, size, n=5):
+    """
+    Read only the header and last n entries of the log file.
+    Only the latest read is cached; it is replaced when the file's modification time or size changes.
+    """
+    with open(LOG_FILE, newline='') as f:
+        header = f.readline()
+        tail = deque(f, maxlen=n)
+    return pd.read_csv(StringIO(header + ''.join(tail)))
 
+@st.fragment
 def render_logging_interface():
-    """Renders the UI for the logging tab."""
+    """
+    Renders the UI for the logging tab.
+    Runs as a fragment so saving a log only reruns this tab, not the whole dashboard.
+    """
     st.markdown("### 📝 Field Activity Log")
     
     st.info("✅ **SFI Soil Standard: ON TRACK** — Your recent soil tests meet the 2025 requirements.")
@@ -88,10 +99,11 @@ def render_logging_interface():
     # --- Display Recent Logs ---
     st.markdown("#### Recent History")
     if os.path.exists(LOG_FILE):
-        history_df = pd.read_csv(LOG_FILE)
+        log_stat = os.stat(LOG_FILE)
+        history_df = load_recent_logs(log_stat.st_mtime_ns, log_stat.st_size)
         if not history_df.empty:
             # Show last 5 entries, sorted by most recent (assuming append order)
-            st.dataframe(history_df.tail(5).iloc[::-1], use_container_width=True, hide_index=True)
+            st.dataframe(history_df.iloc[::-1], use_container_width=True, hide_index=True)
         else:
             st.info("No logs found yet.")
     else:
@@ -1,16 +1,151 @@
 from reportlab.lib.pagesizes import letter, A4
 from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
 from reportlab.lib.units import inch
-from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer, PageBreak, Image
+from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer, KeepTogether, Image
 from reportlab.lib import colors
 from reportlab.lib.enums import TA_CENTER, TA_LEFT, TA_RIGHT, TA_JUSTIFY
+import plotly
 import plotly.io as pio
+import streamlit as st
+import re
+import os
 from io import BytesIO
-from datetime import datetime
+from datetime import date
+from tempfile import TemporaryDirectory
 
-def generate_pdf_report(farm_data, farmer_name, year, insights_list, gauge_fig, pie_fig, donut_fig, bar_fig, line_fig=None):
+# Markdown markers and characters outside WinAnsi (e.g. emoji) that the built-in PDF fonts can't draw
+_MD_STRIP = str.maketrans('', '', '*#')
+_WINANSI_CHARS = bytes(range(256)).decode('cp1252', errors='ignore')
+_UNSUPPORTED_CHARS_RE = re.compile(f"[^{re.escape(_WINANSI_CHARS)}]")
+
+# None of the charts use LaTeX, so the legacy Kaleido scope can skip loading MathJax.
+# The scope only exists before plotly 6; newer versions warn when it is even read.
+if int(plotly.__version__.split('.')[0]) < 6 and pio.kaleido.scope is not None:
+    pio.kaleido.scope.mathjax = None
+
+def clean_pdf_text(text):
+    """Strip markdown markers and unsupported characters in a single pass each"""
+    return _UNSUPPORTED_CHARS_RE.sub('', str(text).translate(_MD_STRIP)).strip()
+
+# Paragraph and table styles are built once and shared by every report
+_STYLES = getSampleStyleSheet()
+
+_TITLE_STYLE = ParagraphStyle(
+    'CustomTitle',
+    parent=_STYLES['Heading1'],
+    fontSize=28,
+    textColor=colors.HexColor('#2d5016'),
+    spaceAfter=12,
+    alignment=TA_CENTER,
+    fontName='Helvetica-Bold'
+)
+
+_HEADING_STYLE = ParagraphStyle(
+    'CustomHeading',
+    parent=_STYLES['Heading2'],
+    fontSize=16,
+    textColor=colors.HexColor('#5d4037'),
+    spaceAfter=12,
+    spaceBefore=12,
+    fontName='Helvetica-Bold',
+    borderPadding=10
+)
+
+_NORMAL_STYLE = ParagraphStyle(
+    'CustomNormal',
+    parent=_STYLES['Normal'],
+    fontSize=11,
+    alignment=TA_JUSTIFY,
+    spaceAfter=12,
+    textColor=colors.HexColor('#5d4037')
+)
+
+_SCORE_HIGH_STYLE = ParagraphStyle('ScoreStyle', parent=_NORMAL_STYLE, fontSize=14, textColor=colors.HexColor('#2d5016'))
+_SCORE_MID_STYLE = ParagraphStyle('ScoreStyle', parent=_NORMAL_STYLE, fontSize=14, textColor=colors.HexColor('#f9a825'))
+_SCORE_LOW_STYLE = ParagraphStyle('ScoreStyle', parent=_NORMAL_STYLE, fontSize=14, textColor=colors.HexColor('#c62828'))
+
+# Score bands (below 50, 50-70, 70+) index straight into these lookups
+_SCORE_STYLES = (_SCORE_LOW_STYLE, _SCORE_MID_STYLE, _SCORE_HIGH_STYLE)
+_SCORE_STATUS = ('Needs Work', 'On Track', 'Healthy')
+_SCORE_MESSAGES = (
+    "Needs Work. Let's improve your practices.",
+    "On Track! A few improvements will help.",
+    "Healthy Profile! You're leading the way.",
+)
+_USAGE_STATUS = ('Low', 'Okay', 'High')
+_SFI_RATE_COLS = ('sfi_soil_compliance_rate', 'sfi_nutrient_compliance_rate', 'sfi_hedgerow_compliance_rate')
+
+_FOOTER_STYLE = ParagraphStyle('Footer', parent=_NORMAL_STYLE, fontSize=9, textColor=colors.grey)
+
+_SCORE_TABLE_STYLE = TableStyle([
+    ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor('#4a7c29')),
+    ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
+    ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
+    ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+    ('FONTSIZE', (0, 0), (-1, 0), 12),
+    ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
+    ('BACKGROUND', (0, 1), (-1, -1), colors.beige),
+    ('GRID', (0, 0), (-1, -1), 1, colors.black),
+    ('FONTSIZE', (0, 1), (-1, -1), 11),
+])
+
+_METRICS_TABLE_STYLE = TableStyle([
+    ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor('#4a7c29')),
+    ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
+    ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
+    ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+    ('FONTSIZE', (0, 0), (-1, 0), 11),
+    ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
+    ('BACKGROUND', (0, 1), (-1, -1), colors.beige),
+    ('GRID', (0, 0), (-1, -1), 1, colors.black),
+    ('FONTSIZE', (0, 1), (-1, -1), 10),
+])
+
+def _score_band(score):
+    """Band index for a 0-100 score where higher is better"""
+    return int(score >= 50) + int(score >= 70)
+
+def _usage_status(value, okay_from, high_from):
+    """Low / Okay / High label for an input where lower is better"""
+    return _USAGE_STATUS[2 - int(value < high_from) - int(value < okay_from)]
+
+def render_chart_images(chart_specs):
+    """
+    Export (fig, width, height) specs to PNG bytes, with None for any chart that can't be rendered.
+    With Kaleido 1.x every export launches Chrome, so the charts are rendered as one batch
+    through a single browser session when plotly supports it.
+    """
+    if hasattr(pio, 'write_images'):
+        try:
+            with TemporaryDirectory() as tmp_dir:
+                paths = [os.path.join(tmp_dir, f"chart_{i}.png") for i in range(len(chart_specs))]
+                pio.write_images(
+                    fig=[fig for fig, _, _ in chart_specs],
+                    file=paths,
+                    format='png',
+                    width=[width for _, width, _ in chart_specs],
+                    height=[height for _, _, height in chart_specs]
+                )
+                images = []
+                for path in paths:
+                    with open(path, 'rb') as f:
+                        images.append(f.read())
+                return images
+        except Exception:
+            pass  # Fall back to one chart at a time so a single failure doesn't drop them all
+    
+    images = []
+    for fig, width, height in chart_specs:
+        try:
+            images.append(fig.to_image(format='png', width=width, height=height))
+        except Exception:
+            images.append(None)
+    return images
+
+def generate_pdf_report(farm_data, farmer_name, year, insights_list, gauge_fig, pie_fig, donut_fig, bar_fig, line_fig=None, report_date=None):
     """
     Generate a comprehensive PDF report with all charts and metrics.
+    report_date is the "Generated" date printed on the report (defaults to today).
     Returns BytesIO object ready for download.
     """
     
@@ -24,143 +159,89 @@ def generate_pdf_report(farm_data, farmer_name, year, insights_list, gauge_fig,
         rightMargin=0.5*inch,
         leftMargin=0.5*inch,
         topMargin=0.75*inch,
-        bottomMargin=0.75*inch
+        bottomMargin=0.75*inch,
+        pageCompression=1  # Compress page streams to keep the download small
     )
     
     # Container for PDF elements
     elements = []
     
-    # Define styles
-    styles = getSampleStyleSheet()
-    
-    # Custom styles
-    title_style = ParagraphStyle(
-        'CustomTitle',
-        parent=styles['Heading1'],
-        fontSize=28,
-        textColor=colors.HexColor('#2d5016'),
-        spaceAfter=12,
-        alignment=TA_CENTER,
-        fontName='Helvetica-Bold'
-    )
-    
-    heading_style = ParagraphStyle(
-        'CustomHeading',
-        parent=styles['Heading2'],
-        fontSize=16,
-        textColor=colors.HexColor('#5d4037'),
-        spaceAfter=12,
-        spaceBefore=12,
-        fontName='Helvetica-Bold',
-        borderPadding=10
-    )
-    
-    normal_style = ParagraphStyle(
-        'CustomNormal',
-        parent=styles['Normal'],
-        fontSize=11,
-        alignment=TA_JUSTIFY,
-        spaceAfter=12,
-        textColor=colors.HexColor('#5d4037')
-    )
+    # Render every chart up front in one export batch
+    chart_specs = [(gauge_fig, 400, 300), (pie_fig, 500, 400), (donut_fig, 500, 400), (bar_fig, 600, 400)]
+    if line_fig:
+        chart_specs.append((line_fig, 600, 400))
+    gauge_png, pie_png, donut_png, bar_png, *rest = render_chart_images(chart_specs)
+    line_png = rest[0] if rest else None
     
     # === HEADER ===
-    elements.append(Paragraph(f"🌾 Farm Sustainability Report", title_style))
+    elements.append(Paragraph(f"🌾 Farm Sustainability Report", _TITLE_STYLE))
     elements.append(Spacer(1, 0.2*inch))
     
     # Use .get() to avoid crashing if optional data is missing
     farm_name_val = farm_data.get('farm_name', 'Unknown Farm')
     
-    elements.append(Paragraph(f"<b>Farm Name:</b> {farm_name_val}", normal_style))
+    elements.append(Paragraph(f"<b>Farm Name:</b> {farm_name_val}", _NORMAL_STYLE))
     # Changed label to "Report For" since we are passing the Farm Name/Greeting here
-    elements.append(Paragraph(f"<b>Report For:</b> {farmer_name}", normal_style))
-    elements.append(Paragraph(f"<b>Year:</b> {year}", normal_style))
-    elements.append(Paragraph(f"<b>Generated:</b> {datetime.now().strftime('%d %B %Y')}", normal_style))
+    elements.append(Paragraph(f"<b>Report For:</b> {farmer_name}", _NORMAL_STYLE))
+    elements.append(Paragraph(f"<b>Year:</b> {year}", _NORMAL_STYLE))
+    elements.append(Paragraph(f"<b>Generated:</b> {(report_date or date.today()).strftime('%d %B %Y')}", _NORMAL_STYLE))
     elements.append(Spacer(1, 0.3*inch))
     
     # === OVERALL SCORE SECTION ===
-    elements.append(Paragraph("Your Farm's ESG Score", heading_style))
+    elements.append(Paragraph("Your Farm's ESG Score", _HEADING_STYLE))
     
     esg_score = farm_data.get('esg_score', 0)
     
     # Updated text to plain English logic
-    if esg_score >= 70:
-        message = "Healthy Profile! You're leading the way."
-        color = "#2d5016"
-    elif esg_score >= 50:
-        message = "On Track! A few improvements will help."
-        color = "#f9a825"
-    else:
-        message = "Needs Work. Let's improve your practices."
-        color = "#c62828"
+    band = _score_band(esg_score)
     
-    elements.append(Paragraph(f"<b>Overall Score: {esg_score:.0f}/100</b>", 
-                             ParagraphStyle('ScoreStyle', parent=normal_style, fontSize=14, 
-                                          textColor=colors.HexColor(color))))
-    elements.append(Paragraph(message, normal_style))
+    elements.append(Paragraph(f"<b>Overall Score: {esg_score:.0f}/100</b>", _SCORE_STYLES[band]))
+    elements.append(Paragraph(_SCORE_MESSAGES[band], _NORMAL_STYLE))
     elements.append(Spacer(1, 0.2*inch))
     
     # Add gauge chart image
-    try:
-        gauge_img_buffer = BytesIO()
-        gauge_fig.write_image(gauge_img_buffer, format='png', width=400, height=300)
-        gauge_img_buffer.seek(0)
-        gauge_img = Image(gauge_img_buffer, width=3*inch, height=2.25*inch)
+    if gauge_png:
+        gauge_img = Image(BytesIO(gauge_png), width=3*inch, height=2.25*inch)
         elements.append(gauge_img)
-    except:
-        elements.append(Paragraph("(Gauge chart unavailable)", normal_style))
+    else:
+        elements.append(Paragraph("(Gauge chart unavailable)", _NORMAL_STYLE))
     
     elements.append(Spacer(1, 0.3*inch))
     
     # === ESG COMPONENTS ===
-    elements.append(Paragraph("Score Breakdown", heading_style))
+    # Chart sections are kept whole instead of forcing page breaks; platypus moves one
+    # to the next page only when it doesn't fit in the space left
+    section_start = len(elements)
+    elements.append(Paragraph("Score Breakdown", _HEADING_STYLE))
     
     e_score = farm_data.get('e_score', 0)
     s_score = farm_data.get('s_score', 0)
     g_score = farm_data.get('g_score', 0)
     
-    # Plain English assessments
-    def get_assessment(score):
-        if score >= 70: return 'Healthy'
-        if score >= 50: return 'On Track'
-        return 'Needs Work'
-
     score_data = [
         ['Component', 'Score', 'Status'],
-        ['Environment (50%)', f"{e_score:.0f}/100", get_assessment(e_score)],
-        ['Social (30%)', f"{s_score:.0f}/100", get_assessment(s_score)],
-        ['Governance (20%)', f"{g_score:.0f}/100", get_assessment(g_score)],
+        ['Environment (50%)', f"{e_score:.0f}/100", _SCORE_STATUS[_score_band(e_score)]],
+        ['Social (30%)', f"{s_score:.0f}/100", _SCORE_STATUS[_score_band(s_score)]],
+        ['Governance (20%)', f"{g_score:.0f}/100", _SCORE_STATUS[_score_band(g_score)]],
     ]
     
     score_table = Table(score_data, colWidths=[2.5*inch, 1.5*inch, 1.5*inch])
-    score_table.setStyle(TableStyle([
-        ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor('#4a7c29')),
-        ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
-        ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
-        ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
-        ('FONTSIZE', (0, 0), (-1, 0), 12),
-        ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
-        ('BACKGROUND', (0, 1), (-1, -1), colors.beige),
-        ('GRID', (0, 0), (-1, -1), 1, colors.black),
-        ('FONTSIZE', (0, 1), (-1, -1), 11),
-    ]))
+    score_table.setStyle(_SCORE_TABLE_STYLE)
     elements.append(score_table)
     elements.append(Spacer(1, 0.3*inch))
     
     # Add pie chart
-    try:
-        pie_img_buffer = BytesIO()
-        pie_fig.write_image(pie_img_buffer, format='png', width=500, height=400)
-        pie_img_buffer.seek(0)
-        pie_img = Image(pie_img_buffer, width=3.5*inch, height=2.8*inch)
+    if pie_png:
+        pie_img = Image(BytesIO(pie_png), width=3.5*inch, height=2.8*inch)
         elements.append(pie_img)
-    except:
-        elements.append(Paragraph("(Pie chart unavailable)", normal_style))
+    else:
+        elements.append(Paragraph("(Pie chart unavailable)", _NORMAL_STYLE))
     
-    elements.append(PageBreak())
+    elements[section_start:] = [KeepTogether(elements[section_start:])]
     
     # === KEY METRICS ===
-    elements.append(Paragraph("Quick Stats", heading_style))
+    section_start = len(elements)
+    elements.append(Paragraph("Quick Stats", _HEADING_STYLE))
     
     # Safe extraction of optional metrics
     area = farm_data.get('total_farm_area_ha', 0)
@@ -168,19 +249,8 @@ def generate_pdf_report(farm_data, farmer_name, year, insights_list, gauge_fig,
     nitrogen = farm_data.get('n_per_ha', 0)
     
     # Calculate SFI average safely
-    sfi_score = 0
-    sfi_count = 0
-    if 'sfi_soil_compliance_rate' in farm_data: 
-        sfi_score += farm_data['sfi_soil_compliance_rate']
-        sfi_count += 1
-    if 'sfi_nutrient_compliance_rate' in farm_data: 
-        sfi_score += farm_data['sfi_nutrient_compliance_rate']
-        sfi_count += 1
-    if 'sfi_hedgerow_compliance_rate' in farm_data: 
-        sfi_score += farm_data['sfi_hedgerow_compliance_rate']
-        sfi_count += 1
-        
-    sfi_final = (sfi_score / max(sfi_count, 1)) * 100 if sfi_count > 0 else 0
+    sfi_rates = [farm_data[col] for col in _SFI_RATE_COLS if col in farm_data]
+    sfi_pct = sum(sfi_rates) / len(sfi_rates) * 100 if sfi_rates else 0
 
     # New Logic: Healthy / Low / Needs work / On track
     metrics_data = [
@@ -188,44 +258,29 @@ def generate_pdf_report(farm_data, farmer_name, year, insights_list, gauge_fig,
         ['Total Farm Area', f"{area:.1f} ha", '✓ On Track'],
         
         # Emissions (Lower is better)
-        ['Emissions', f"{emissions:.0f} kg/ha", 'Low' if emissions < 30 else 'Okay' if emissions < 50 else 'High'],
+        ['Emissions', f"{emissions:.0f} kg/ha", _usage_status(emissions, 30, 50)],
         
         # Nitrogen (Lower is better)
-        ['Nitrogen Use', f"{nitrogen:.0f} kg/ha", 'Low' if nitrogen < 50 else 'Okay' if nitrogen < 100 else 'High'],
+        ['Nitrogen Use', f"{nitrogen:.0f} kg/ha", _usage_status(nitrogen, 50, 100)],
         
         # Compliance
-        ['Compliance', f"{sfi_final:.0f}%", 'Healthy' if sfi_final > 80 else 'On Track'],
+        ['Compliance', f"{sfi_pct:.0f}%", 'Healthy' if sfi_pct > 80 else 'On Track'],
     ]
     
     metrics_table = Table(metrics_data, colWidths=[2.5*inch, 1.5*inch, 1.5*inch])
-    metrics_table.setStyle(TableStyle([
-        ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor('#4a7c29')),
-        ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
-        ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
-        ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
-        ('FONTSIZE', (0, 0), (-1, 0), 11),
-        ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
-        ('BACKGROUND', (0, 1), (-1, -1), colors.beige),
-        ('GRID', (0, 0), (-1, -1), 1, colors.black),
-        ('FONTSIZE', (0, 1), (-1, -1), 10),
-    ]))
+    metrics_table.setStyle(_METRICS_TABLE_STYLE)
     elements.append(metrics_table)
     elements.append(Spacer(1, 0.3*inch))
     
     # Add donut chart
-    try:
-        donut_img_buffer = BytesIO()
-        donut_fig.write_image(donut_img_buffer, format='png', width=500, height=400)
-        donut_img_buffer.seek(0)
-        donut_img = Image(donut_img_buffer, width=3.5*inch, height=2.8*inch)
+    if donut_png:
+        donut_img = Image(BytesIO(donut_png), width=3.5*inch, height=2.8*inch)
         elements.append(donut_img)
-    except:
-        pass
     
-    elements.append(PageBreak())
+    elements[section_start:] = [KeepTogether(elements[section_start:])]
     
     # === RECOMMENDATIONS ===
-    elements.append(Paragraph("What You Can Do This Season", heading_style))
+    elements.append(Paragraph("What You Can Do This Season", _HEADING_STYLE))
     
     # Filter out the "Hello X" greeting from the insights list so it doesn't look weird in a list
     clean_insights = [i for i in insights_list if not i.lower().startswith(('hello', 'hi ', 'dear'))]
@@ -234,43 +289,52 @@ def generate_pdf_report(farm_data, farmer_name, year, insights_list, gauge_fig,
         clean_insights = insights_list # Fallback if filtering removes everything
 
     for i, insight in enumerate(clean_insights, 1):
-        elements.append(Paragraph(f"<b>{i}.</b> {insight}", normal_style))
+        elements.append(Paragraph(f"<b>{i}.</b> {clean_pdf_text(insight)}", _NORMAL_STYLE))
     
     elements.append(Spacer(1, 0.3*inch))
     
     # === COMPARISON ===
-    elements.append(Paragraph("Your Farm vs. Others", heading_style))
+    section_start = len(elements)
+    elements.append(Paragraph("Your Farm vs. Others", _HEADING_STYLE))
     
-    try:
-        bar_img_buffer = BytesIO()
-        bar_fig.write_image(bar_img_buffer, format='png', width=600, height=400)
-        bar_img_buffer.seek(0)
-        bar_img = Image(bar_img_buffer, width=5*inch, height=3.33*inch)
+    if bar_png:
+        bar_img = Image(BytesIO(bar_png), width=5*inch, height=3.33*inch)
         elements.append(bar_img)
-    except:
-        elements.append(Paragraph("(Comparison chart unavailable)", normal_style))
+    else:
+        elements.append(Paragraph("(Comparison chart unavailable)", _NORMAL_STYLE))
+    
+    elements[section_start:] = [KeepTogether(elements[section_start:])]
     
     # Add multi-year progress if available
     if line_fig:
-        elements.append(PageBreak())
-        elements.append(Paragraph("Your Progress Over Time", heading_style))
-        try:
-            line_img_buffer = BytesIO()
-            line_fig.write_image(line_img_buffer, format='png', width=600, height=400)
-            line_img_buffer.seek(0)
-            line_img = Image(line_img_buffer, width=5*inch, height=3.33*inch)
+        section_start = len(elements)
+        elements.append(Paragraph("Your Progress Over Time", _HEADING_STYLE))
+        if line_png:
+            line_img = Image(BytesIO(line_png), width=5*inch, height=3.33*inch)
             elements.append(line_img)
-        except:
-            pass
+        elements[section_start:] = [KeepTogether(elements[section_start:])]
     
     elements.append(Spacer(1, 0.5*inch))
     elements.append(Paragraph(
         "<i>This report was generated by the AgriESG Dashboard.</i>",
-        ParagraphStyle('Footer', parent=normal_style, fontSize=9, textColor=colors.grey)
+        _FOOTER_STYLE
     ))
     
     # Build PDF
     doc.build(elements)
     pdf_buffer.seek(0)
     
-    return pdf_buffer
\ No newline at end of file
+    return pdf_buffer
+
+@st.cache_data(ttl=1800, max_entries=16, show_spinner=False)
+def generate_pdf_report_bytes(farm_data, farmer_name, year, insights_list, gauge_fig, pie_fig, donut_fig, bar_fig, line_fig=None, *, report_date) -> bytes:
+    """
+    Cached wrapper around generate_pdf_report.
+    The report is only rebuilt when the farm data, insights, charts or report date change.
+    """
+    pdf_buffer = generate_pdf_report(
+        farm_data, farmer_name, year, insights_list,
+        gauge_fig, pie_fig, donut_fig, bar_fig, line_fig,
+        report_date=report_date
+    )
+    return pdf_buffer.getvalue()
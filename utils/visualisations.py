@@ -1,5 +1,30 @@
 import plotly.graph_objects as go
 
+# Fixed chart labels and colours, built once at import instead of on every rerun
+SCORE_LABELS = ('Environment', 'Social', 'Governance')
+SCORE_COLORS = ('#4a7c29', '#8d6e63', '#f9a825')
+SCORE_DESCRIPTIONS = (
+    "Nature (Chemicals, Soil, Water)",
+    "People (Safety, Fair Pay)",
+    "Records (Compliance, SFI)"
+)
+
+EMISSION_LABELS = ('Fertilizer', 'Diesel', 'Electricity')
+EMISSION_COLORS = ('#c62828', '#f9a825', '#8d6e63')
+
+COMPARISON_CATEGORIES = ('Overall ESG', 'Environment', 'Social', 'Governance')
+
+GAUGE_STEPS = (
+    {'range': [0, 40], 'color': "#fcc0c9"},
+    {'range': [40, 70], 'color': "#f8eecc"},
+    {'range': [70, 100], 'color': "#bef8c3"}
+)
+GAUGE_HOVER_TEXT = (
+    "<b>What this means:</b><br>" +
+    "This summarizes your environmental impact,<br>" +
+    "worker safety, and paperwork compliance."
+)
+
 def create_gauge_chart(value: float, title: str = "Score") -> go.Figure:
     """
     Farmer-friendly gauge chart with tooltip (invisible hover trigger).
@@ -19,11 +44,7 @@ def create_gauge_chart(value: float, title: str = "Score") -> go.Figure:
             'bgcolor': "white",
             'borderwidth': 3,
             'bordercolor': "#e0e0e0",
-            'steps': [
-                {'range': [0, 40], 'color': "#fcc0c9"},  
-                {'range': [40, 70], 'color': "#f8eecc"},  
-                {'range': [70, 100], 'color': "#bef8c3"}  
-            ],
+            'steps': GAUGE_STEPS,
             'threshold': {
                 'line': {'color': "#295e06", 'width': 4},
                 'thickness': 0.75,
@@ -39,11 +60,7 @@ def create_gauge_chart(value: float, title: str = "Score") -> go.Figure:
         mode='markers',
         marker=dict(opacity=0, size=150), # Invisible (opacity 0) but large enough to hit
         hoverinfo='text',
-        text=(
-            "<b>What this means:</b><br>" +
-            "This summarizes your environmental impact,<br>" +
-            "worker safety, and paperwork compliance."
-        )
+        text=GAUGE_HOVER_TEXT
     ))
     
     fig.update_layout(
@@ -62,12 +79,23 @@ def create_gauge_chart(value: float, title: str = "Score") -> go.Figure:
 
 def create_progress_line_chart(data: list[dict]) -> go.Figure:
     """Line chart with plain English tooltip"""
-    years = [d['year'] for d in data]
-    scores = [d['esg_score'] for d in data]
+    years, scores = zip(*((d['year'], d['esg_score']) for d in data)) if data else ((), ())
     
-    fig = go.Figure()
+    # Both axes are configured up front so the layout is set in a single pass
+    xaxis = dict(
+        title=dict(text="Year"),
+        showgrid=True,
+        gridcolor='#e0e0e0',
+        showline=True,
+        linewidth=2,
+        linecolor='#e0e0e0'
+    )
+    if len(years) > 0:
+        min_y, max_y = min(years), max(years)
+        padding = 1 if min_y == max_y else (max_y - min_y) * 0.1
+        xaxis['range'] = [min_y - padding, max_y + padding]
     
-    fig.add_trace(go.Scatter(
+    trace = go.Scatter(
         x=years,
         y=scores,
         mode='lines+markers+text',
@@ -75,7 +103,7 @@ def create_progress_line_chart(data: list[dict]) -> go.Figure:
         line=dict(color='#4a7c29', width=4),
         marker=dict(size=14, color='#2d5016', symbol='circle',
                    line=dict(width=2, color='white')),
-        text=[f"{s:.0f}" for s in scores],
+        texttemplate='%{y:.0f}',
         textposition="top center",
         textfont=dict(size=14, color='#2d5016', family='Inter', weight=700),
         fill='tozeroy',
@@ -87,50 +115,37 @@ def create_progress_line_chart(data: list[dict]) -> go.Figure:
             '<i>What this means: Tracking if your farm is getting<br>more sustainable over time.</i><extra></extra>'
         ),
         cliponaxis=False 
-    ))
+    )
     
-    fig.update_layout(
+    fig = go.Figure(data=[trace], layout=dict(
         title=dict(text="Your ESG Score Progress", font=dict(size=20, family='Inter', weight=600, color='#5d4037')),
-        xaxis_title="Year",
-        yaxis_title="ESG Score",
-        yaxis=dict(range=[0, 115], gridcolor='#e0e0e0'),
-        xaxis=dict(gridcolor='#e0e0e0'),
+        xaxis=xaxis,
+        yaxis=dict(
+            title=dict(text="ESG Score"),
+            range=[0, 115],
+            showgrid=True,
+            gridwidth=1,
+            gridcolor='#e0e0e0'
+        ),
         paper_bgcolor="white",
         plot_bgcolor="white",
         font=dict(family="Inter", size=14, color='#5d4037'),
         hovermode='x unified',
         height=380,
         margin=dict(l=60, r=60, t=60, b=50) 
-    )
-    
-    if len(years) > 0:
-        min_y, max_y = min(years), max(years)
-        padding = 1 if min_y == max_y else (max_y - min_y) * 0.1
-        fig.update_xaxes(range=[min_y - padding, max_y + padding])
-        
-    fig.update_xaxes(showgrid=True, showline=True, linewidth=2, linecolor='#e0e0e0')
-    fig.update_yaxes(showgrid=True, gridwidth=1, gridcolor='#e0e0e0')
+    ))
     
     return fig
 
 def create_score_breakdown_pie(e_score: float, s_score: float, g_score: float) -> go.Figure:
     """Pie chart with plain English tooltip"""
-    labels = ['Environment', 'Social', 'Governance']
     values = [e_score, s_score, g_score]
-    colors = ['#4a7c29', '#8d6e63', '#f9a825']
-    
-    # Plain english descriptions for the tooltip
-    descriptions = [
-        "Nature (Chemicals, Soil, Water)",
-        "People (Safety, Fair Pay)",
-        "Records (Compliance, SFI)"
-    ]
     
     fig = go.Figure(data=[go.Pie(
-        labels=labels,
+        labels=SCORE_LABELS,
         values=values,
-        customdata=descriptions,
-        marker=dict(colors=colors, line=dict(color='white', width=3)),
+        customdata=SCORE_DESCRIPTIONS,  # Plain english descriptions for the tooltip
+        marker=dict(colors=SCORE_COLORS, line=dict(color='white', width=3)),
         textinfo='label+percent',
         textfont=dict(size=16, family='Inter', weight=600),
         # Enhanced Tooltip
@@ -162,15 +177,13 @@ def create_score_breakdown_pie(e_score: float, s_score: float, g_score: float) -
 
 def create_emissions_donut(fertilizer: float, diesel: float, electricity: float) -> go.Figure:
     """Donut chart with plain English tooltip"""
-    labels = ['Fertilizer', 'Diesel', 'Electricity']
     values = [fertilizer, diesel, electricity]
-    colors = ['#c62828', '#f9a825', '#8d6e63']
     
     fig = go.Figure(data=[go.Pie(
-        labels=labels,
+        labels=EMISSION_LABELS,
         values=values,
         hole=0.4,
-        marker=dict(colors=colors, line=dict(color='white', width=3)),
+        marker=dict(colors=EMISSION_COLORS, line=dict(color='white', width=3)),
         textinfo='label+percent',
         textfont=dict(size=15, family='Inter', weight=600),
         # Enhanced Tooltip
@@ -206,22 +219,24 @@ def create_emissions_donut(fertilizer: float, diesel: float, electricity: float)
     
     return fig
 
-def create_comparison_bar(my_farm: dict, all_farms_df) -> go.Figure:
-    """Bar chart with plain English tooltip and fixed text colors for Dark Mode"""
+def create_comparison_bar(my_farm: dict, peer_avg: dict = None) -> go.Figure:
+    """
+    Bar chart with plain English tooltip and fixed text colors for Dark Mode.
+    peer_avg holds precomputed average scores of the uploaded farms; None compares against industry targets.
+    """
     
-    if len(all_farms_df) < 2:
+    if peer_avg is None:
         avg_esg, avg_e, avg_s, avg_g = 60.0, 55.0, 50.0, 65.0
         comparison_label = "Industry Standard"
         desc = "Based on typical industry targets."
     else:
-        avg_esg = all_farms_df['esg_score'].mean()
-        avg_e = all_farms_df['e_score'].mean()
-        avg_s = all_farms_df['s_score'].mean()
-        avg_g = all_farms_df['g_score'].mean()
+        avg_esg = peer_avg['esg_score']
+        avg_e = peer_avg['e_score']
+        avg_s = peer_avg['s_score']
+        avg_g = peer_avg['g_score']
         comparison_label = "Average Farm"
         desc = "Based on the average of all uploaded farms."
     
-    categories = ['Overall ESG', 'Environment', 'Social', 'Governance']
     my_scores = [my_farm['esg_score'], my_farm['e_score'], my_farm['s_score'], my_farm['g_score']]
     avg_scores = [avg_esg, avg_e, avg_s, avg_g]
     
@@ -229,10 +244,10 @@ def create_comparison_bar(my_farm: dict, all_farms_df) -> go.Figure:
     
     fig.add_trace(go.Bar(
         name='Your Farm',
-        x=categories,
+        x=COMPARISON_CATEGORIES,
         y=my_scores,
         marker_color='#4a7c29',
-        text=[f"{s:.0f}" for s in my_scores],
+        texttemplate='%{y:.0f}',
         textposition='outside',
         textfont=dict(size=14, weight=700, color='#5d4037'), 
         hovertemplate=(
@@ -244,10 +259,10 @@ def create_comparison_bar(my_farm: dict, all_farms_df) -> go.Figure:
     
     fig.add_trace(go.Bar(
         name=comparison_label,
-        x=categories,
+        x=COMPARISON_CATEGORIES,
         y=avg_scores,
         marker_color='#a1887f',
-        text=[f"{s:.0f}" for s in avg_scores],
+        texttemplate='%{y:.0f}',
         textposition='outside',
         textfont=dict(size=14, weight=700, color='#5d4037'),
         hovertemplate=(